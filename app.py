@@ -1,11 +1,13 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
 from datetime import datetime
 
 import config
 import drive_utils
-from database import DatabaseManager
+from database import DatabaseManager, connect_readonly
 
 # Page Config
 st.set_page_config(
@@ -18,6 +20,11 @@ st.set_page_config(
 db_manager = DatabaseManager()
 
 # --- HELPER FUNCTIONS ---
+@st.cache_data(show_spinner=False)
+def get_cached_stocks(db_path, db_mtime):
+    # db_mtime is only part of the cache key: a fresh download invalidates it
+    return DatabaseManager(db_path).get_all_stocks()
+
 def load_data(force_refresh=False):
     # Auto-download if DB is missing (First run on Cloud) or forced
     if not config.DB_PATH.exists() or force_refresh:
@@ -30,7 +37,7 @@ def load_data(force_refresh=False):
                 st.error(f"Sync Failed: {msg}")
                 return pd.DataFrame()
     
-    return db_manager.get_all_stocks()
+    return get_cached_stocks(str(config.DB_PATH), config.DB_PATH.stat().st_mtime_ns)
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -62,7 +69,7 @@ if df.empty:
     st.stop()
 
 # --- KEY METRICS (Active Only) ---
-active_df = df[df['IsClosed'] == 0].copy()
+active_df = df[df['IsClosed'] == 0]
 col1, col2, col3, col4 = st.columns(4)
 with col1:
     st.metric("Total Active Picks", len(active_df))
@@ -114,77 +121,95 @@ st.dataframe(
 # --- DETAIL TABLE ---
 st.subheader("📋 Detail List")
 
-# Apply Filters
-filtered_df = df.copy()
+# Apply Filters: combine into one boolean mask and slice once
+mask = np.ones(len(df), dtype=bool)
 
 # Filter Year
 if selected_years:
-    filtered_df = filtered_df[filtered_df['Pick_Date'].dt.year.isin(selected_years)]
+    mask &= df['Pick_Date'].dt.year.isin(selected_years).to_numpy()
 
 # Filter Status
 if selected_status == "Active":
-    filtered_df = filtered_df[filtered_df['IsClosed'] == 0]
+    mask &= (df['IsClosed'] == 0).to_numpy()
 elif selected_status == "Closed":
-    filtered_df = filtered_df[filtered_df['IsClosed'] == 1]
+    mask &= (df['IsClosed'] == 1).to_numpy()
 
+filtered_df = df[mask].copy()
 
-# Ensure Action_Date is formatted as string for display
-# This prevents Styler/ColumnConfig mismatch issues
-filtered_df['Action_Date_Str'] = filtered_df['Action_Date'].apply(lambda x: x.strftime('%d-%m-%Y') if pd.notnull(x) else "")
 
 # Map IsClosed to String
 filtered_df['Status'] = filtered_df['IsClosed'].map({0: 'Active', 1: 'Closed'})
 
-# Styling function for Rating and Returns
-def style_table(styler):
-    def color_val(val):
-        if pd.isna(val): return ''
-        color = 'green' if val > 0 else '#d32f2f' if val < 0 else 'black'
-        return f'color: {color}'
-    
-    def color_rating(val):
-        if val == "Outperform": return 'color: green; font-weight: bold'
-        if val == "Underperform": return 'color: #d32f2f; font-weight: bold'
-        return 'color: gray'
-
-    def color_status(val):
-        return 'color: green; font-weight: bold' if val == 'Active' else 'color: gray'
-
-    return (styler
-        .format({
-            'Pick_Date': '{:%Y-%m-%d}',
-            'Price_At_Call': '{:,.0f}',
-            'LastPrice': '{:,.0f}',
-            'Stock_Ret': '{:.2%}',
-            'VNI_Ret': '{:.2%}',
-            'Alpha': '{:.2%}'
-        })
-        .map(color_val, subset=['Stock_Ret', 'Alpha'])
-        .map(color_rating, subset=['Rating'])
-        .map(color_status, subset=['Status'])
-    )
-
-# Select Columns for Display (Use Action_Date_Str)
+# Select Columns for Display
 display_cols = [
     'Ticker', 'Pick_Date', 'Price_At_Call', 
-    'Action_Date_Str', 'LastPrice', 
+    'Action_Date', 'LastPrice', 
     'Stock_Ret', 'VNI_Ret', 'Alpha', 'Rating', 
     'Status'
 ]
 
+# Formatting and coloring run as JS in the grid, only for the rows on screen,
+# instead of a Styler formatting every cell in Python on every rerun
+fmt_date = JsCode("""function(params) {
+    return params.value ? params.value.split('-').reverse().join('-') : '';
+}""")
+fmt_price = JsCode("""function(params) {
+    return params.value == null ? '' : Math.round(params.value).toLocaleString('en-US');
+}""")
+fmt_pct = JsCode("""function(params) {
+    return params.value == null ? '' : (params.value * 100).toFixed(2) + '%';
+}""")
+color_val = JsCode("""function(params) {
+    if (params.value == null) return null;
+    return {color: params.value > 0 ? 'green' : params.value < 0 ? '#d32f2f' : 'black'};
+}""")
+color_rating = JsCode("""function(params) {
+    if (params.value === 'Outperform') return {color: 'green', fontWeight: 'bold'};
+    if (params.value === 'Underperform') return {color: '#d32f2f', fontWeight: 'bold'};
+    return {color: 'gray'};
+}""")
+color_status = JsCode("""function(params) {
+    return params.value === 'Active' ? {color: 'green', fontWeight: 'bold'} : {color: 'gray'};
+}""")
+
+# ISO date strings keep the columns sortable; fmt_date shows them as DD-MM-YYYY
+display_df = filtered_df[display_cols].assign(
+    Pick_Date=filtered_df['Pick_Date'].dt.strftime('%Y-%m-%d'),
+    Action_Date=filtered_df['Action_Date'].dt.strftime('%Y-%m-%d'),
+)
+
+gb = GridOptionsBuilder.from_dataframe(display_df)
+gb.configure_column("Pick_Date", header_name="Pick Date", valueFormatter=fmt_date)
+gb.configure_column("Price_At_Call", valueFormatter=fmt_price)
+gb.configure_column("Action_Date", header_name="Close/Action Date", valueFormatter=fmt_date)
+gb.configure_column("LastPrice", valueFormatter=fmt_price)
+gb.configure_column("Stock_Ret", header_name="Stock Return", valueFormatter=fmt_pct, cellStyle=color_val)
+gb.configure_column("VNI_Ret", header_name="Index Return", valueFormatter=fmt_pct)
+gb.configure_column("Alpha", valueFormatter=fmt_pct, cellStyle=color_val)
+gb.configure_column("Rating", cellStyle=color_rating)
+gb.configure_column("Status", cellStyle=color_status)
+
 # Display Table
-st.dataframe(
-    style_table(filtered_df[display_cols].style),
-    use_container_width=True,
+AgGrid(
+    display_df,
+    gridOptions=gb.build(),
     height=600,
-    column_config={
-        "Action_Date_Str": "Close/Action Date",
-        "Stock_Ret": st.column_config.NumberColumn("Stock Return"), # Remove format, let Styler handle it
-        "VNI_Ret": st.column_config.NumberColumn("Index Return"),   # Remove format
-        "Pick_Date": st.column_config.DateColumn("Pick Date", format="DD-MM-YYYY"),
-    }
+    theme="streamlit",
+    update_mode=GridUpdateMode.NO_UPDATE,
+    allow_unsafe_jscode=True,
+    key="detail_list",
 )
 
 # --- FOOTER ---
-if st.checkbox("Show Raw Data"):
-    st.write(df)
+# Toggling the raw-data view only reruns this fragment, not the whole page
+@st.fragment
+def show_raw_data():
+    if st.checkbox("Show Raw Data"):
+        # Every column, read only on demand: the cached frame above keeps just what the page uses
+        conn = connect_readonly(config.DB_PATH)
+        try:
+            st.write(pd.read_sql_query("SELECT * FROM StockInFocus", conn))
+        finally:
+            conn.close()
+
+show_raw_data()
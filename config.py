@@ -1,4 +1,5 @@
 import os
+import json
 import streamlit as st
 from pathlib import Path
 
@@ -12,11 +13,34 @@ BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR  # Root in this simple setup
 DB_FILENAME = "stockinfocus.db"
 DB_PATH = DATA_DIR / DB_FILENAME
+DB_META_PATH = DATA_DIR / f"{DB_FILENAME}.meta.json" # Drive metadata of the local copy
+RESOLVED_IDS_FILE = BASE_DIR / "resolved_ids.json" # filename -> Drive file ID, pinned by lookups
 
 # Constants
 CREDENTIALS_FILE = "dangvu-n8n-a9b0e98a1f79.json"
 TARGET_FILE_NAME = "stockinfocus.db" 
 DRIVE_FILE_ID = "12p23dXf_h56Eg2UPzzTKaov02qLuq61j" # Found via list_drive_files.py
+DURABLE_DOWNLOAD = False # fsync the downloaded DB before swapping it in
+DROP_DOWNLOAD_CACHE = False # Evict the new DB from the page cache after download (implies an fsync)
+
+# Local cache for Drive auth state that survives process restarts
+CACHE_DIR = Path.home() / ".cache" / "stockinfocus"
+TOKEN_CACHE_PATH = CACHE_DIR / "drive_token.json"
+
+
+def load_resolved_ids():
+    """Returns the filename -> Drive file ID map pinned by earlier lookups."""
+    try:
+        with open(RESOLVED_IDS_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Without a hardcoded ID, use the one pinned by the first successful search
+DRIVE_FILE_ID_PINNED = False
+if not DRIVE_FILE_ID:
+    DRIVE_FILE_ID = load_resolved_ids().get(TARGET_FILE_NAME)
+    DRIVE_FILE_ID_PINNED = DRIVE_FILE_ID is not None
 
 
 def get_credentials_info():
@@ -36,7 +60,6 @@ def get_credentials_info():
     # Fallback to local file
     json_path = BASE_DIR / CREDENTIALS_FILE
     if json_path.exists():
-        import json
         with open(json_path, 'r') as f:
             return json.load(f)
             
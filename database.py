@@ -1,59 +1,91 @@
+import os
 import sqlite3
 import pandas as pd
 import numpy as np
+import streamlit as st
 import config
+from pathlib import Path
 from datetime import datetime, timedelta
 
+
+def connect_readonly(db_path):
+    # Read-only: the app never writes, and sync replaces the whole file
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute("PRAGMA query_only = 1")
+    conn.execute("PRAGMA mmap_size = 268435456")  # 256 MB memory-mapped reads
+    conn.execute("PRAGMA cache_size = -65536")    # 64 MB page cache
+    return conn
+
+
+# max_entries=1: a new download changes db_mtime, and the old frame is dropped
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _load_vnindex_cached(db_path, db_mtime):
+    """
+    Reads VNINDEX once per (db_path, db_mtime) and shares the sorted
+    (dates, closes) arrays across DatabaseManager instances and reruns.
+    Treat the result as read-only.
+    """
+    conn = connect_readonly(db_path)
+    try:
+        query = "SELECT Date, Close FROM VNINDEX ORDER BY Date"
+        df = pd.read_sql_query(query, conn)
+        df['Date'] = pd.to_datetime(df['Date']).dt.normalize()
+        df = df.dropna(subset=['Date']).sort_values('Date', kind='stable')
+        return df['Date'].to_numpy(dtype='datetime64[ns]'), df['Close'].to_numpy(dtype='float64')
+    finally:
+        conn.close()
+
+
 class DatabaseManager:
     def __init__(self, db_path=None):
         self.db_path = db_path or config.DB_PATH
-        self.vni_map = {}
-        self.vni_dates = []
+        self.vni_dates_np = np.array([], dtype='datetime64[ns]')
+        self.vni_closes_np = np.array([], dtype='float64')
 
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        return connect_readonly(self.db_path)
 
     def load_vnindex(self):
         """
         Loads VNINDEX history into memory for fast lookup.
         """
-        conn = self.get_connection()
         try:
-            query = "SELECT Date, Close FROM VNINDEX ORDER BY Date"
-            df = pd.read_sql_query(query, conn)
-            df['Date'] = pd.to_datetime(df['Date']).dt.normalize()
-            self.vni_map = dict(zip(df['Date'], df['Close']))
-            self.vni_dates = sorted(self.vni_map.keys())
+            db_mtime = os.stat(self.db_path).st_mtime_ns
+            self.vni_dates_np, self.vni_closes_np = _load_vnindex_cached(str(self.db_path), db_mtime)
         except Exception as e:
             print(f"Error loading VNINDEX: {e}")
-        finally:
-            conn.close()
 
     def get_nearest_vni(self, target_date):
         """
         Finds VNI close price on target_date. 
         If missing (weekend/holiday), finds the nearest previous trading day.
+        Accepts a single date (returns float or None) or an array of dates
+        (returns a float array with NaN where no previous day exists).
         """
-        if not self.vni_map:
+        if self.vni_dates_np.size == 0:
             self.load_vnindex()
-            
-        target_date = pd.to_datetime(target_date)
-        
-        # Try direct lookup first
-        if target_date in self.vni_map:
-            return self.vni_map[target_date]
-        
-        # Look backwards
-        # We can use numpy searchsorted if performance is critical, 
-        # but simple loop or pandas asof is fine for small data.
-        # Since self.vni_dates is sorted:
-        import bisect
-        idx = bisect.bisect_right(self.vni_dates, target_date)
-        if idx > 0:
-            nearest_date = self.vni_dates[idx - 1]
-            return self.vni_map[nearest_date]
-        
-        return None
+
+        is_scalar = np.ndim(target_date) == 0
+        targets = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(target_date)))
+
+        closes = np.full(len(targets), np.nan)
+        if self.vni_dates_np.size:
+            # Index of the last trading day <= target (exact match included)
+            idx = np.searchsorted(self.vni_dates_np, targets.to_numpy(dtype='datetime64[ns]'), side='right') - 1
+            found = (idx >= 0) & targets.notna()
+            closes[found] = self.vni_closes_np[idx[found]]
+
+        if is_scalar:
+            return None if np.isnan(closes[0]) else closes[0]
+        return closes
+
+    def get_nearest_vni_series(self, dates):
+        """
+        Series wrapper around get_nearest_vni: one searchsorted over all dates.
+        Returns VNI closes aligned to the input index (NaN if missing).
+        """
+        return pd.Series(self.get_nearest_vni(dates.to_numpy()), index=dates.index, dtype='float64')
 
     def get_all_stocks(self):
         """
@@ -65,35 +97,29 @@ class DatabaseManager:
         try:
             query = """
                 SELECT 
-                    Id, Ticker, Pick_Date, Price_At_Call, 
-                    TargetPrice, StopLoss, 
-                    LastPrice, IsClosed, Current_Action,
-                    ShortTermConviction, LongTermConviction, Action_Date,
-                    PickedBy
+                    Ticker, Pick_Date, Price_At_Call, 
+                    LastPrice, IsClosed,
+                    ShortTermConviction, Action_Date
                 FROM StockInFocus
                 ORDER BY Pick_Date DESC
             """
             df = pd.read_sql_query(query, conn)
             
             # 1. Date Conversions
-            # Use mixed format inference and normalize to midnight (remove time)
-            df['Pick_Date'] = pd.to_datetime(df['Pick_Date']).dt.normalize()
+            # Dates are stored as ISO-8601 TEXT: use the fixed-format C parser
+            # rather than per-value 'mixed' inference, then normalize to midnight
+            df['Pick_Date'] = pd.to_datetime(df['Pick_Date'], format='ISO8601').dt.normalize()
             
             # Action_Date: "2026-01-08 07:32:14..." -> 2026-01-08 00:00:00
-            df['Action_Date'] = pd.to_datetime(df['Action_Date'], format='mixed', errors='coerce').dt.normalize()
+            df['Action_Date'] = pd.to_datetime(df['Action_Date'], format='ISO8601', errors='coerce').dt.normalize()
             
             # 2. Determine Close Date for Calculation
             # If Closed -> Use Action_Date.
             # If Active -> Use Today normalized
             today = pd.Timestamp.now().normalize()
             
-            # Helper to extract just the date part for safety
-            def get_calc_date(row):
-                if row['IsClosed'] == 1 and pd.notnull(row['Action_Date']):
-                    return row['Action_Date']
-                return today
-
-            df['Calc_Close_Date'] = df.apply(get_calc_date, axis=1)
+            closed_mask = df['IsClosed'].eq(1) & df['Action_Date'].notna()
+            df['Calc_Close_Date'] = df['Action_Date'].where(closed_mask, today)
 
             # 3. Calculate Stock Return
             # Logic: (LastPrice - Price_At_Call) / Price_At_Call
@@ -101,9 +127,9 @@ class DatabaseManager:
 
             # 4. Calculate VNI Return
             # VNI_Start
-            df['VNI_Pick'] = df['Pick_Date'].apply(self.get_nearest_vni)
+            df['VNI_Pick'] = self.get_nearest_vni_series(df['Pick_Date'])
             # VNI_End
-            df['VNI_Close'] = df['Calc_Close_Date'].apply(self.get_nearest_vni)
+            df['VNI_Close'] = self.get_nearest_vni_series(df['Calc_Close_Date'])
             
             # Handle case where VNI lookup returns None (e.g. data strictly missing)
             # Fill with 0 return or NaN to avoid crash
@@ -111,14 +137,11 @@ class DatabaseManager:
 
             # 5. Alpha & Rating
             df['Alpha'] = df['Stock_Ret'] - df['VNI_Ret']
-            
-            def get_rating(alpha):
-                if pd.isna(alpha): return "N/A"
-                if alpha > 0: return "Outperform"
-                if alpha < 0: return "Underperform"
-                return "Neutral"
-
-            df['Rating'] = df['Alpha'].apply(get_rating)
+            df['Rating'] = np.select(
+                [df['Alpha'].isna(), df['Alpha'] > 0, df['Alpha'] < 0],
+                ["N/A", "Outperform", "Underperform"],
+                default="Neutral"
+            )
             
             return df
 
@@ -138,43 +161,38 @@ class DatabaseManager:
         if df.empty:
             return pd.DataFrame()
 
-        # Work on a copy to avoid side effects
-        df = df.copy()
-        df['Year'] = df['Pick_Date'].dt.year
-        
-        # Helper to format percentage string
-        def format_pct_count(series, target_rating, total_count):
-            count = (series == target_rating).sum()
-            if total_count == 0: return "0% (0/0)"
-            pct = (count / total_count) * 100
-            return f"{pct:.1f}% ({count}/{total_count})"
-
-        # 1. Calculate Yearly Stats
-        years = sorted(df['Year'].unique(), reverse=True)
-        summary_data = []
-
-        for year in years:
-            year_df = df[df['Year'] == year]
-            total = len(year_df)
-            
-            summary_data.append({
-                "Year": str(year),
-                "Total Calls": total,
-                "Median Return": year_df['Stock_Ret'].median(),
-                "Median Alpha": year_df['Alpha'].median(),
-                "% Outperform": format_pct_count(year_df['Rating'], "Outperform", total),
-                "% Underperform": format_pct_count(year_df['Rating'], "Underperform", total)
-            })
-
-        # 2. Calculate Grant Total (All Time)
-        total_all = len(df)
-        summary_data.append({
-            "Year": "Total",
-            "Total Calls": total_all,
+        # Helper to format percentage strings, vectorized over rows
+        def format_pct_count(counts, totals):
+            pct = (counts / totals * 100).map('{:.1f}'.format)
+            return pct + "% (" + counts.astype(str) + "/" + totals.astype(str) + ")"
+
+        ratings = ['Outperform', 'Underperform']
+
+        # 1. Calculate Yearly Stats in one groupby pass (newest year first)
+        grouped = df.groupby(df['Pick_Date'].dt.year.rename('Year'))
+        stats = grouped.agg(**{
+            "Total Calls": ('Rating', 'size'),
+            "Median Return": ('Stock_Ret', 'median'),
+            "Median Alpha": ('Alpha', 'median'),
+        })
+        counts = (grouped['Rating'].value_counts()
+                  .unstack(fill_value=0)
+                  .reindex(columns=ratings, fill_value=0))
+        stats = stats.join(counts).sort_index(ascending=False)
+        stats.index = stats.index.astype(int).astype(str)
+
+        # 2. Calculate Grand Total (All Time)
+        rating_counts = df['Rating'].value_counts()
+        stats.loc["Total"] = pd.Series({
+            "Total Calls": len(df),
             "Median Return": df['Stock_Ret'].median(),
             "Median Alpha": df['Alpha'].median(),
-            "% Outperform": format_pct_count(df['Rating'], "Outperform", total_all),
-            "% Underperform": format_pct_count(df['Rating'], "Underperform", total_all)
+            **{r: int(rating_counts.get(r, 0)) for r in ratings},
         })
-            
-        return pd.DataFrame(summary_data)
+
+        totals = stats["Total Calls"].astype(int)
+        stats["Total Calls"] = totals
+        for rating in ratings:
+            stats[f"% {rating}"] = format_pct_count(stats.pop(rating).astype(int), totals)
+
+        return stats.rename_axis("Year").reset_index()
@@ -1,76 +1,370 @@
 import os
-import io
-import time
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+import json
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import config
 
+log = logging.getLogger(__name__)
+
+# Google client libraries are imported inside the functions that need them:
+# they are slow to import and unused when the app starts with a local DB.
+
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+COPY_BUFFER_SIZE = 1024 * 1024
+META_FIELDS = "name, md5Checksum, modifiedTime, size"
+ZSTD_SUFFIX = ".zst" # Drive copies stored zstd-compressed, decompressed on download
+PARALLEL_DOWNLOAD_MIN_SIZE = 50 * 1024 * 1024
+RANGE_WORKERS = 8
+# Google APIs only gzip responses when the User-Agent also mentions gzip
+GZIP_HEADERS = {'Accept-Encoding': 'gzip', 'User-Agent': 'stockinfocus (gzip)'}
+
+# Built once per process; reruns and repeated syncs reuse them
+_CREDENTIALS = None
+_SERVICE = None
+_SESSION = None
+# Reruns and sessions share one DB file, so only one sync may run at a time
+_SYNC_LOCK = threading.Lock()
+
+
+def _load_cached_token(creds):
+    """Restores an access token saved by a previous process, if it is for this account."""
+    try:
+        with open(config.TOKEN_CACHE_PATH, 'r') as f:
+            cached = json.load(f)
+        if cached.get('client_email') != creds.service_account_email:
+            return
+        creds.token = cached['token']
+        creds.expiry = datetime.fromisoformat(cached['expiry'])
+    except (OSError, ValueError, KeyError):
+        pass # No usable cache, a fresh token will be minted
+
+def _save_token(creds):
+    """Persists the current access token (owner-only permissions)."""
+    try:
+        config.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd = os.open(config.TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'client_email': creds.service_account_email,
+                'token': creds.token,
+                'expiry': creds.expiry.isoformat(),
+            }, f)
+    except OSError:
+        pass # Cache is an optimization only
+
+def get_credentials():
+    """Returns service account credentials with a valid access token (cached per process)."""
+    global _CREDENTIALS
+    if _CREDENTIALS is not None:
+        return _CREDENTIALS
+
+    from google.oauth2 import service_account
+    from google.auth.transport.requests import Request
 
-def get_drive_service():
-    """Authenticates and returns the Drive service."""
     creds_info = config.get_credentials_info()
     if not creds_info:
         raise Exception("Credentials not found. Check config.py or st.secrets.")
-        
+
     creds = service_account.Credentials.from_service_account_info(
         creds_info, scopes=SCOPES
     )
-    service = build('drive', 'v3', credentials=creds)
-    return service
+    _load_cached_token(creds)
+    if not creds.valid:
+        creds.refresh(Request())
+        _save_token(creds)
+
+    _CREDENTIALS = creds
+    return _CREDENTIALS
+
+def get_drive_service():
+    """Authenticates and returns the Drive service (cached per process)."""
+    global _SERVICE
+    if _SERVICE is not None:
+        return _SERVICE
+
+    from googleapiclient.discovery import build
+
+    creds = get_credentials()
+    # Use the discovery document bundled with the client instead of fetching it
+    _SERVICE = build('drive', 'v3', credentials=creds, cache_discovery=False, static_discovery=True)
+    return _SERVICE
+
+def get_authorized_session():
+    """Returns a keep-alive HTTP session that signs requests with the Drive credentials."""
+    global _SESSION
+    if _SESSION is None:
+        from google.auth.transport.requests import AuthorizedSession
+        _SESSION = AuthorizedSession(get_credentials())
+    return _SESSION
+
+def _write_resolved_ids(ids):
+    try:
+        with open(config.RESOLVED_IDS_FILE, 'w') as f:
+            json.dump(ids, f)
+    except OSError:
+        pass # Pinning is an optimization only
+
+def pin_file_id(filename, file_id):
+    """Saves a resolved ID so later runs (and this one) skip the search."""
+    ids = config.load_resolved_ids()
+    ids[filename] = file_id
+    _write_resolved_ids(ids)
+    if filename == config.TARGET_FILE_NAME and not config.DRIVE_FILE_ID:
+        config.DRIVE_FILE_ID, config.DRIVE_FILE_ID_PINNED = file_id, True
+
+def forget_file_id(filename):
+    """Drops a pinned ID, e.g. after Drive reports it as missing."""
+    ids = config.load_resolved_ids()
+    if ids.pop(filename, None) is not None:
+        _write_resolved_ids(ids)
+    if filename == config.TARGET_FILE_NAME and config.DRIVE_FILE_ID_PINNED:
+        config.DRIVE_FILE_ID, config.DRIVE_FILE_ID_PINNED = None, False
 
 def find_file_id_by_name(service, filename):
-    """Searches for a file by name and returns its ID."""
-    print(f"Searching for '{filename}' on Drive...")
+    """Searches for a file by name and returns its ID (pinned on disk by filename)."""
+    cached_id = config.load_resolved_ids().get(filename)
+    if cached_id:
+        return cached_id
+
+    log.debug("Searching for '%s' on Drive", filename)
     query = f"name = '{filename}' and trashed = false"
+    # Only the ID of the first match is used
     results = service.files().list(
-        q=query, pageSize=10, fields="nextPageToken, files(id, name, modifiedTime, size)"
+        q=query, pageSize=1, fields="files(id)", spaces='drive'
     ).execute()
     items = results.get('files', [])
 
     if not items:
-        print(f"No file found with name '{filename}'")
+        log.debug("No file found with name '%s'", filename)
         return None
     
     # Return the first match (most relevant)
     file = items[0]
-    print(f"Found file: {file['name']} (ID: {file['id']}, Size: {file.get('size')} bytes)")
+    log.debug("Found file: %s (ID: %s)", filename, file['id'])
+    pin_file_id(filename, file['id'])
     return file['id']
 
-def download_file_from_drive(file_id, local_path):
-    """Downloads a file from Drive to local path."""
-    service = get_drive_service()
-    request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    print(f"Downloading file ID {file_id} to {local_path}...")
-    while done is False:
-        status, done = downloader.next_chunk()
-        # print(f"Download {int(status.progress() * 100)}%.")
-    
-    with open(local_path, 'wb') as f:
-        f.write(fh.getbuffer())
-    print("Download complete.")
+def get_file_metadata(session, file_id):
+    """
+    Returns the Drive metadata used to decide whether the local copy is current.
+    Goes through the same keep-alive session as the media GET, so the download
+    reuses this request's connection.
+    """
+    resp = session.get(f"{DRIVE_FILES_URL}/{file_id}", params={'fields': META_FIELDS})
+    resp.raise_for_status()
+    return resp.json()
+
+def read_local_meta():
+    """Returns the metadata saved with the last download, or None."""
+    try:
+        with open(config.DB_META_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_local_meta(meta):
+    with open(config.DB_META_PATH, 'w') as f:
+        json.dump(meta, f)
+
+def is_local_current(remote_meta):
+    """True if the local DB was downloaded from the same Drive revision."""
+    local_meta = read_local_meta()
+    if not local_meta or not config.DB_PATH.exists():
+        return False
+    if remote_meta.get('md5Checksum'):
+        return local_meta.get('md5Checksum') == remote_meta['md5Checksum']
+    return (local_meta.get('modifiedTime'), local_meta.get('size')) == \
+        (remote_meta.get('modifiedTime'), remote_meta.get('size'))
+
+def _stream_to_file(session, url, f):
+    """Copies the whole media body into f with one GET."""
+    with session.get(url, params={'alt': 'media'}, headers=GZIP_HEADERS, stream=True) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True # Undo any transfer gzip while copying
+        shutil.copyfileobj(resp.raw, f, length=COPY_BUFFER_SIZE)
+
+def _stream_zstd_to_file(session, url, f):
+    """
+    Decompresses a zstd media body into f while it streams in.
+    Returns the hex MD5 of the compressed bytes, i.e. of the file as stored on Drive.
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("The Drive file is zstd-compressed; install 'zstandard' to download it.")
+
+    digest = hashlib.md5()
+    dobj = zstandard.ZstdDecompressor().decompressobj(write_size=COPY_BUFFER_SIZE)
+    # Already compressed: asking for gzip on top would only cost CPU
+    with session.get(url, params={'alt': 'media'}, stream=True) as resp:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(COPY_BUFFER_SIZE):
+            digest.update(chunk)
+            f.write(dobj.decompress(chunk))
+    # A body cut off mid-frame decompresses without error, just short
+    if not dobj.eof:
+        raise Exception("Incomplete download: zstd stream ended before the end of the frame")
+    return digest.hexdigest()
+
+def _download_range(session, url, fd, start, end, stop):
+    """
+    Fetches bytes [start, end] and writes them at the same offset in fd.
+    Gives up between chunks once stop is set (another range failed).
+    """
+    # Byte ranges refer to the stored bytes, so ask for them unencoded
+    headers = {'Range': f"bytes={start}-{end}", 'Accept-Encoding': 'identity'}
+    with session.get(url, params={'alt': 'media'}, headers=headers, stream=True) as resp:
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            raise Exception("Drive ignored the Range request")
+        offset = start
+        for chunk in resp.iter_content(COPY_BUFFER_SIZE):
+            if stop.is_set():
+                return
+            view = memoryview(chunk)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+    if offset != end + 1:
+        raise Exception(f"Incomplete range {start}-{end}: got {offset - start} bytes")
+
+def _download_ranges(session, url, f, size):
+    """Downloads size bytes as parallel Range GETs written in place into f."""
+    f.truncate(size)
+    part = -(-size // RANGE_WORKERS) # ceil division
+    ranges = [(lo, min(lo + part, size) - 1) for lo in range(0, size, part)]
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=RANGE_WORKERS)
+    try:
+        futures = [pool.submit(_download_range, session, url, f.fileno(), lo, hi, stop)
+                   for lo, hi in ranges]
+        for future in as_completed(futures):
+            future.result() # Re-raises the first failure
+    except BaseException:
+        # Don't wait for the other ranges to finish downloading
+        stop.set()
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _download_raw(session, url, f, size):
+    """Writes the stored bytes into f, preallocated and ranged when size is known."""
+    if size and hasattr(os, 'posix_fallocate'):
+        # Reserve all blocks up front instead of growing the file per write
+        os.posix_fallocate(f.fileno(), 0, size)
+    if size and size >= PARALLEL_DOWNLOAD_MIN_SIZE and hasattr(os, 'pwrite'):
+        _download_ranges(session, url, f, size)
+    else:
+        _stream_to_file(session, url, f)
+        # A short body would otherwise leave preallocated zeros at the end
+        if size and f.tell() != size:
+            raise Exception(f"Incomplete download: got {f.tell()} of {size} bytes")
+
+def _file_md5(f):
+    """Hex MD5 of everything written to f, read back from the start."""
+    f.flush()
+    f.seek(0)
+    digest = hashlib.md5()
+    for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+def download_file_from_drive(file_id, local_path, session=None, size=None, compressed=False, md5=None):
+    """
+    Downloads a file from Drive to local path.
+    Files of known size above PARALLEL_DOWNLOAD_MIN_SIZE are fetched as
+    parallel byte ranges; everything else uses a single streaming GET.
+    With compressed=True the body is zstd-decompressed on the fly; size is
+    then the compressed size and is not used for preallocation.
+    If md5 (Drive's md5Checksum) is given, a mismatching download is
+    discarded with an error instead of being swapped in.
+    """
+    session = session or get_authorized_session()
+    url = f"{DRIVE_FILES_URL}/{file_id}"
+    # Stream into a private sibling temp file and swap it in, so readers never see a partial DB
+    fd, part_path = tempfile.mkstemp(
+        prefix=f"{os.path.basename(local_path)}.", suffix='.part',
+        dir=os.path.dirname(local_path) or '.'
+    )
+    log.debug("Downloading file ID %s to %s", file_id, local_path)
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            if compressed:
+                digest = _stream_zstd_to_file(session, url, f)
+            else:
+                _download_raw(session, url, f, size)
+                digest = _file_md5(f) if md5 else None
+            # Ranges of a file replaced mid-download can mix two revisions;
+            # only the checksum proves the bytes form one consistent copy
+            if digest and digest != md5:
+                raise Exception("Downloaded DB does not match the Drive checksum")
+            drop_cache = getattr(config, 'DROP_DOWNLOAD_CACHE', False) and hasattr(os, 'posix_fadvise')
+            if drop_cache or getattr(config, 'DURABLE_DOWNLOAD', False):
+                f.flush()
+                os.fsync(f.fileno())
+            if drop_cache:
+                # Pages are clean only after the fsync, so only now can the
+                # kernel drop them. SQLite reads back just what it needs.
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        os.replace(part_path, local_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    log.debug("Download complete")
     
 def check_and_update_db():
     """
     Main function to sync DB.
-    1. Connect to Drive.
-    2. Download to local using Configured ID.
+    1. Connect to Drive (one keep-alive session for metadata and media).
+    2. Skip if the local copy matches the Drive checksum.
+    3. Download to local using Configured ID.
+    Concurrent calls run one after another, so later ones see the fresh sidecar.
     """
+    with _SYNC_LOCK:
+        return _check_and_update_db()
+
+def _check_and_update_db():
     try:
-        service = get_drive_service()
-        file_id = getattr(config, 'DRIVE_FILE_ID', None)
-        
-        if not file_id:
-            file_id = find_file_id_by_name(service, config.TARGET_FILE_NAME)
+        configured_id = getattr(config, 'DRIVE_FILE_ID', None)
+        # A pinned ID came from an earlier search and may go stale; a hardcoded one is trusted
+        hardcoded_id = configured_id and not getattr(config, 'DRIVE_FILE_ID_PINNED', False)
+
+        from requests import HTTPError # Transport used by the authorized session
+
+        session = get_authorized_session()
+        # The discovery-based service is only needed to search by name
+        file_id = configured_id or find_file_id_by_name(get_drive_service(), config.TARGET_FILE_NAME)
         
         if file_id:
-            download_file_from_drive(file_id, config.DB_PATH)
+            try:
+                remote_meta = get_file_metadata(session, file_id)
+            except HTTPError as e:
+                if hardcoded_id or e.response is None or e.response.status_code != 404:
+                    raise
+                # Cached ID went stale (file re-uploaded): search once more
+                forget_file_id(config.TARGET_FILE_NAME)
+                file_id = find_file_id_by_name(get_drive_service(), config.TARGET_FILE_NAME)
+                if not file_id:
+                    return False, f"File '{config.TARGET_FILE_NAME}' not found on Drive."
+                remote_meta = get_file_metadata(session, file_id)
+
+            if is_local_current(remote_meta):
+                return True, "Data is already up to date"
+
+            size = int(remote_meta['size']) if remote_meta.get('size') else None
+            compressed = remote_meta.get('name', '').endswith(ZSTD_SUFFIX)
+            download_file_from_drive(file_id, config.DB_PATH, session, size=size, compressed=compressed,
+                                     md5=remote_meta.get('md5Checksum'))
+            write_local_meta(remote_meta)
             return True, "Update successful"
         else:
             return False, f"File '{config.TARGET_FILE_NAME}' not found on Drive."
@@ -80,5 +374,6 @@ def check_and_update_db():
 
 if __name__ == "__main__":
     # Test script
+    logging.basicConfig(level=logging.DEBUG)
     success, msg = check_and_update_db()
     print(msg)